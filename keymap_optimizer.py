@@ -1,18 +1,144 @@
-import sys
+import argparse
+import math
+import mmap
+import os
 from itertools import combinations, permutations
 
+import numpy as np
 from ortools.sat.python import cp_model
 
+try:
+    from numba import njit, types
+except ImportError:
+    njit = None
 
-def optimize_keymap(penalty2, letters, input_text):
+
+def _bigram_kernel(buf, index_table, n):
+    """
+    バイト列を1回走査して連接頻度を数える。numbaがあればJITコンパイルして使います。
+    Args:
+        buf (numpy.ndarray): 入力テキストのバイト列 (uint8)。
+        index_table (numpy.ndarray): 文字コード -> 文字番号の変換表 (int8)。対象外の文字は-1。
+        n (int): 文字数。
+    Returns:
+        numpy.ndarray: freq[i][j] = 文字i, jの順に現れた回数 (int32)。
+    """
+    freq = np.zeros((n, n), dtype=np.int32)
+    for i in range(buf.size - 1):
+        a = index_table[buf[i]]
+        b = index_table[buf[i + 1]]
+        if a >= 0 and b >= 0:
+            freq[a, b] += 1
+    return freq
+
+
+if njit is not None:
+    # シグネチャを指定して読み込み時にコンパイルしておく cache=Trueなので2回目以降はディスクから読むだけ
+    # バイト列はbytesやmmapから作るので読み取り専用になる
+    _bigram_kernel = njit(types.int32[:, ::1](types.Array(types.uint8, 1, 'C', readonly=True),
+                                              types.int8[::1], types.int64),
+                          cache=True)(_bigram_kernel)
+
+
+def count_bigrams(letters, input_bytes, block_size=1 << 20):
+    """
+    入力テキストの連接頻度を数える関数。
+    numbaがあればJITコンパイルしたループで、なければブロックごとにnp.bincountで数えます。
+    Args:
+        letters (list of str): 数える文字のリスト。1文字ずつの大文字のASCII文字。
+        input_bytes (bytes or mmap.mmap): 連接頻度を計算するための入力テキストのバイト列。
+            小文字は大文字として数えます。
+        block_size (int): numbaがないときに一度に数えるバイト数。
+    Returns:
+        numpy.ndarray: freq[i][j] = letters[i], letters[j]の順に現れた回数 (int32)。
+    """
+    L = len(letters)
+
+    # 文字コード -> 文字番号の変換表 対象外の文字は-1にする
+    # 小文字も同じ番号にしておけば、テキストを大文字に変換してコピーする必要がない
+    index_table = np.full(256, -1, dtype=np.int8)
+    for i, letter in enumerate(letters):
+        index_table[ord(letter)] = i
+        index_table[ord(letter.lower())] = i
+
+    buf = np.frombuffer(input_bytes, dtype=np.uint8)
+    if njit is not None:
+        return _bigram_kernel(buf, index_table, L)
+
+    # 大きなファイルでも作業用の配列が入力に比例して増えないよう、ブロックごとに数える
+    # 次のブロックの先頭の文字との連接も数えるため、1文字重ねて取り出す
+    counts = np.zeros(L * L, dtype=np.int64)
+    for start in range(0, buf.size - 1, block_size):
+        index = index_table[buf[start:start + block_size + 1]]
+        first = index[:-1]
+        second = index[1:]
+        valid = (first >= 0) & (second >= 0)
+        counts += np.bincount(first[valid].astype(np.int16) * L + second[valid], minlength=L * L)
+    return counts.reshape(L, L).astype(np.int32)
+
+
+def print_keymap(result):
+    """
+    キーマップを10列3行で表示する関数。
+    Args:
+        result (list of str): キーの位置に対応する文字のリスト。
+    """
+    for i, l in enumerate(result):
+        print(l, end=' ')
+        if i % 10 == 9:
+            print("")
+
+
+class KeymapSolutionCallback(cp_model.CpSolverSolutionCallback):
+    """
+    CP-SATが改善解を見つけるたびに呼ばれるコールバック。
+    途中のキーマップと目的関数の値を表示し、目標値に達したら探索を打ち切ります。
+    """
+
+    def __init__(self, positions, target_objective=None):
+        """
+        Args:
+            positions (dict): positions[letter] = 文字letterを割り当てたキーを表す変数または式。
+            target_objective (float): この値以下の解が見つかったら探索を打ち切る。Noneの場合は打ち切らない。
+        """
+        super().__init__()
+        self.positions = positions
+        self.target_objective = target_objective
+        self.solution_count = 0
+
+    def on_solution_callback(self):
+        self.solution_count += 1
+        objective = self.ObjectiveValue()
+        print(f"Solution {self.solution_count}: Objective = {objective}, Time = {self.WallTime():.1f} sec")
+
+        result = [None] * len(self.positions)
+        for letter, position in self.positions.items():
+            result[self.Value(position)] = letter
+        print_keymap(result)
+
+        if self.target_objective is not None and objective <= self.target_objective:
+            print(f"Objective reached the target {self.target_objective}")
+            self.StopSearch()
+
+
+def optimize_keymap(penalty2, letters, input_bytes, num_workers=None, pin_top_letter=False,
+                    formulation='linear', target_objective=None, stop_after_first_solution=False):
     """
     キーマップを最適化する関数。
     この関数は、与えられた文字のリストと入力テキストに基づいて、キーの割り当てを最適化します。
     最適化は、連接頻度とペナルティ行列に基づいて行われます。
     Args:
-        penalty2 (list of list of int): キー間のペナルティを表す行列。
+        penalty2 (list of list of int): キー間のペナルティを表す行列。整数に変換したもの。
         letters (list of str): 割り当てる文字のリスト。
-        input_text (str): 連接頻度を計算するための入力テキスト。
+        input_bytes (bytes or mmap.mmap): 連接頻度を計算するための入力テキストのバイト列。
+        num_workers (int): CP-SATの並列探索に使うワーカー数。Noneの場合はCPUのコア数。
+        pin_top_letter (bool): 最も頻度の高い文字を最もペナルティの小さいキーに固定するかどうか。
+        formulation (str): モデルの定式化。
+            'linear': 割り当て変数の積を線形化する。
+            'element': 割り当て変数を使わず、文字の位置を整数変数で表してAddElementでペナルティを引く。
+                実験的な定式化で、通常はlinearより遅い。
+        target_objective (float): この値以下の解が見つかったら探索を打ち切る。Noneの場合は打ち切らない。
+        stop_after_first_solution (bool): 最初の実行可能解が見つかったら探索を打ち切るかどうか。
     Returns:
         list of str: 最適化されたキー割り当てを表すリスト。キーの位置に対応する文字が格納されます。
         None: 最適化が失敗した場合。
@@ -23,45 +149,128 @@ def optimize_keymap(penalty2, letters, input_text):
     solver = cp_model.CpSolver()
     solver.parameters.max_time_in_seconds = 900  # 時間制限 sec
     solver.parameters.log_search_progress = True
+    # 複数の探索戦略を並列に走らせる
+    solver.parameters.num_workers = num_workers or os.cpu_count() or 8
+    # 二次割当問題はLP緩和を強めた方が下界が上がりやすい
+    solver.parameters.linearization_level = 2
+    solver.parameters.stop_after_first_solution = stop_after_first_solution
+
+    L = len(letters)
+    # 文字番号の順序付きの組
+    letter_pairs = list(permutations(range(L), 2))
+
+    # 連接頻度
+    bigrams = count_bigrams(letters, input_bytes)
+
+    # 目的関数で使う連接頻度とペナルティ
+    # 同じ文字の連続とk1 >= k2の組は数えない 積があふれないようにint64で計算する
+    freq = np.array(bigrams, dtype=np.int64)
+    np.fill_diagonal(freq, 0)
+    key_penalty = np.triu(np.array(penalty2, dtype=np.int64), k=1)
 
-    # キーの割り当て keyの位置にletterを割り当てる
-    variables = {}
-    for letter in letters:
-        for key, _ in enumerate(letters):
-            variables[(letter, key)] = model.NewBoolVar(f'{letter}_{key}')
+    if formulation == 'element':
+        # pos[l] = 文字lを割り当てたキー 割り当て変数の格子は作らない
+        pos = {}
+        for letter in letters:
+            pos[letter] = model.NewIntVar(0, L - 1, f'pos_{letter}')
+
+        # 制約条件1, 2: 各文字は異なるキーに割り当てる
+        model.AddAllDifferent(pos.values())
+        positions = pos
+    else:
+        # キーの割り当て keyの位置にletterを割り当てる
+        variables = {}
+        for letter in letters:
+            for key in range(L):
+                variables[(letter, key)] = model.NewBoolVar(f'{letter}_{key}')
 
-    # 文字l1, l2をキーk1, k2に割り当てる
-    for l1, l2 in permutations(letters, 2):
-        for k1, k2 in combinations(range(len(letters)), 2):
-            variables[(l1, l2, k1, k2)] = model.NewBoolVar(f'{l1}_{l2}_{k1}_{k2}')
+        # 制約条件1: 各文字は1つのキーにのみ割り当て可能
+        for letter in letters:
+            model.AddExactlyOne(variables[(letter, key)] for key in range(L))
 
-    # 制約条件1: 各文字は1つのキーにのみ割り当て可能
-    for letter in letters:
-        model.Add(cp_model.LinearExpr.Sum([variables[(letter, key)] for key, _ in enumerate(letters)]) == 1)
+        # 制約条件2: 各キーには1つの文字のみ割り当て可能 文字数とキー数が等しいので必ず1文字になる
+        for key in range(L):
+            model.AddExactlyOne(variables[(letter, key)] for letter in letters)
 
-    # 制約条件2: 各キーには1つの文字のみ割り当て可能
-    for key, _ in enumerate(letters):
-        model.Add(cp_model.LinearExpr.Sum([variables[(letter, key)] for letter in letters]) <= 1)
+        # 途中経過の表示に使う文字の位置
+        positions = {}
+        for letter in letters:
+            positions[letter] = cp_model.LinearExpr.WeightedSum(
+                [variables[(letter, key)] for key in range(L)], list(range(L)))
 
-    # 制約条件3: variables[(l1, l2, k1, k2)]とvariables[(l1, k1)]とvariables[(l2, k2)]の関係
-    for l1, l2 in permutations(letters, 2):
-        for k1, k2 in combinations(range(len(letters)), 2):
-            model.AddBoolAnd([variables[(l1, k1)], variables[(l2, k2)]]).OnlyEnforceIf(variables[(l1, l2, k1, k2)])
-            model.AddBoolOr([variables[(l1, k1)].Not(), variables[(l2, k2)].Not()]).OnlyEnforceIf(variables[(l1, l2, k1, k2)].Not())
+    # 制約条件3: 最も頻度の高い文字を、前後どちらの打鍵でもペナルティの合計が最も小さいキーに固定する
+    # ペナルティ行列は対称ではないので最適性は保証されないが、探索空間が1/Lになる
+    pinned = None
+    if pin_top_letter:
+        letter_order, key_order = rank_letters_and_keys(freq, key_penalty)
+        pinned = (letter_order[0], key_order[0])
+        if formulation == 'element':
+            model.Add(pos[letters[pinned[0]]] == pinned[1])
+        else:
+            model.Add(variables[(letters[pinned[0]], pinned[1])] == 1)
 
     # 目的関数 = Sum(連接頻度 x ペナルティ)
-    expr = []
-    coef = []
-    for l1, l2 in permutations(letters, 2):
-        freq = input_text.count(l1 + l2)
-        # print(f"{l1}{l2}: {freq}")
-        for k1, k2 in combinations(range(len(letters)), 2):
-            expr.append(variables[(l1, l2, k1, k2)])
-            coef.append(freq * penalty2[k1][k2])
-    model.Minimize(cp_model.LinearExpr.WeightedSum(expr, coef))
-
-    # 最適化の実行
-    status = solver.solve(model)
+    if formulation == 'element':
+        # 文字l1, l2の順に打鍵するときのペナルティをpos[l1] * L + pos[l2]番目の要素として取り出す
+        flat_penalty = key_penalty.ravel().tolist()
+        max_penalty = max(flat_penalty)
+        expr = []
+        coef = []
+        # 連接頻度が0の組は目的関数に寄与しないので、変数も制約も作らない
+        for i, j in letter_pairs:
+            if freq[i][j] == 0:
+                continue
+            l1 = letters[i]
+            l2 = letters[j]
+            index = model.NewIntVar(0, L * L - 1, f'index_{l1}_{l2}')
+            model.Add(index == pos[l1] * L + pos[l2])
+            c = model.NewIntVar(0, max_penalty, f'penalty_{l1}_{l2}')
+            model.AddElement(index, flat_penalty, c)
+            expr.append(c)
+            coef.append(int(freq[i][j]))
+        model.Minimize(cp_model.LinearExpr.WeightedSum(expr, coef))
+    else:
+        # 文字l1, l2をキーk1, k2に割り当てる変数を作らずに線形化する。
+        # cost[(l1, k1)]はl1をk1に割り当てたときに、l1から始まる連接で生じるペナルティの合計。
+        # l1がk1にないときは制約が外れて0まで下がるので、最小化すれば積の和と一致する。
+        # 連接頻度が0の組は係数も0なので式に入れない
+        # 1つも連接がない文字から始まるcostは常に0なので、その文字は最初から除く
+        active = np.flatnonzero(freq.sum(axis=1))
+        # weight[row, l2, k1, k2] = 文字active[row], l2の連接頻度 x ペナルティ
+        weight = freq[active, :, None, None] * key_penalty[None, None, :, :]
+
+        # grid[l2 * L + k2] = variables[(l2, k2)] weight[l1, :, k1, :].ravel()と順番を揃える
+        grid = [variables[(letter, key)] for letter in letters for key in range(L)]
+        cost = []
+        for row, i in enumerate(active):
+            l1 = letters[i]
+            for k1 in range(L):
+                w = weight[row, :, k1, :]
+                # l2が置かれるキーは1つなので、各l2の最大の係数の和が上限になる
+                upper = int(w.max(axis=1).sum())
+                if upper == 0:
+                    continue
+                coef = w.ravel()
+                nonzero = np.flatnonzero(coef)
+                expr = cp_model.LinearExpr.WeightedSum([grid[n] for n in nonzero], coef[nonzero].tolist())
+                c = model.NewIntVar(0, upper, f'cost_{l1}_{k1}')
+                model.Add(c >= expr).OnlyEnforceIf(variables[(l1, k1)])
+                cost.append(c)
+        model.Minimize(cp_model.LinearExpr.Sum(cost))
+
+    # 貪欲法と2-optで作った配置をヒントとして与える 固定した文字はそのキーから動かさない
+    hint_pos = greedy_layout(freq, key_penalty, pinned)
+    print(f"Hint objective = {layout_cost(freq, key_penalty, hint_pos)}")
+    for i, letter in enumerate(letters):
+        if formulation == 'element':
+            model.AddHint(pos[letter], hint_pos[i])
+        else:
+            for key in range(L):
+                model.AddHint(variables[(letter, key)], int(key == hint_pos[i]))
+
+    # 最適化の実行 改善解が見つかるたびに途中経過を表示する
+    callback = KeymapSolutionCallback(positions, target_objective)
+    status = solver.solve(model, callback)
 
     # 結果の表示
     print(f"Status = {solver.StatusName(status)}")
@@ -69,17 +278,192 @@ def optimize_keymap(penalty2, letters, input_text):
 
     # result[key] = letterを作る
     if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
-        result = [None] * len(letters)
-        for letter in letters:
-            for key in range(len(letters)):
-                # print(f"{letter}: {key} = {solver.Value(variables[(letter, key)])}")
-                if solver.Value(variables[(letter, key)]) > 0.5:
+        # solver.Valueを変数ごとに呼ばず、解をまとめて取り出して変数の番号で参照する
+        solution = solver.ResponseProto().solution
+        result = [None] * L
+        if formulation == 'element':
+            for letter, var in pos.items():
+                result[solution[var.Index()]] = letter
+        else:
+            for (letter, key), var in variables.items():
+                if solution[var.Index()] > 0:
                     result[key] = letter
         return result
     else:
         return None
 
 
+def layout_cost(freq, penalty, pos):
+    """
+    キー配置のコストを計算する関数。
+    Args:
+        freq (numpy.ndarray): freq[i][j] = 文字i, jの連接頻度。
+        penalty (numpy.ndarray): penalty[k1][k2] = キーk1, k2を順に打鍵するときのペナルティ。
+        pos (list of int): pos[i] = 文字iを割り当てたキー。
+    Returns:
+        int: Sum(連接頻度 x ペナルティ)
+    """
+    return int(np.sum(freq * penalty[np.ix_(pos, pos)]))
+
+
+def swap_delta(freq, penalty, pos, a, b):
+    """
+    文字a, bのキーを入れ替えたときのコストの変化量を計算する関数。
+    a, bに関わる行と列の差分だけを足し合わせるので、計算量はO(L)です。
+    焼きなましで何十万回も呼ぶので、numpyの配列ではなくリストで受け取ります。
+    Args:
+        freq (list of list of int): freq[i][j] = 文字i, jの連接頻度。
+        penalty (list of list of int): penalty[k1][k2] = キーk1, k2を順に打鍵するときのペナルティ。
+        pos (list of int): pos[i] = 文字iを割り当てたキー。
+        a (int): 入れ替える文字の番号。
+        b (int): 入れ替える文字の番号。
+    Returns:
+        int: 入れ替え後のコスト - 入れ替え前のコスト
+    """
+    fa = freq[a]
+    fb = freq[b]
+    pa = pos[a]
+    pb = pos[b]
+    qa = penalty[pa]
+    qb = penalty[pb]
+
+    # a, b同士の連接
+    delta = (fa[a] - fb[b]) * (qb[pb] - qa[pa]) + (fa[b] - fb[a]) * (qb[pa] - qa[pb])
+    # a, bとそれ以外の文字kの連接
+    for k, pk in enumerate(pos):
+        if k == a or k == b:
+            continue
+        fk = freq[k]
+        rk = penalty[pk]
+        delta += (fa[k] - fb[k]) * (qb[pk] - qa[pk]) + (fk[a] - fk[b]) * (rk[pb] - rk[pa])
+    return delta
+
+
+def rank_letters_and_keys(freq, penalty):
+    """
+    文字を連接頻度の合計が大きい順に、キーをペナルティの合計が小さい順に並べる関数。
+    どちらも前後両方の打鍵を合計します。
+    Args:
+        freq (numpy.ndarray): freq[i][j] = 文字i, jの連接頻度。
+        penalty (numpy.ndarray): penalty[k1][k2] = キーk1, k2を順に打鍵するときのペナルティ。
+    Returns:
+        list of int: 文字の番号を並べたリスト。
+        list of int: キーの番号を並べたリスト。
+    """
+    letter_order = np.argsort(-(freq.sum(axis=0) + freq.sum(axis=1)), kind='stable')
+    key_order = np.argsort(penalty.sum(axis=0) + penalty.sum(axis=1), kind='stable')
+    return letter_order.tolist(), key_order.tolist()
+
+
+def greedy_layout(freq, penalty, pinned=None, max_passes=5):
+    """
+    貪欲法でキー配置を作り、2-optで改善する関数。
+    連接頻度の合計が大きい文字から順に、ペナルティの合計が小さいキーへ割り当てたあと、
+    コストが下がる2文字の入れ替えがなくなるか、max_passes回走査するまで入れ替えを繰り返します。
+    Args:
+        freq (numpy.ndarray): freq[i][j] = 文字i, jの連接頻度。
+        penalty (numpy.ndarray): penalty[k1][k2] = キーk1, k2を順に打鍵するときのペナルティ。
+        pinned (tuple of int): (文字の番号, キー) 最初からこのキーに置き、入れ替えない文字。Noneの場合は固定しない。
+        max_passes (int): 全ての2文字の組を走査する最大回数。
+    Returns:
+        list of int: pos[i] = 文字iを割り当てたキー。
+    """
+    L = len(freq)
+    letter_order, key_order = rank_letters_and_keys(freq, penalty)
+    pos = [0] * L
+    if pinned is not None:
+        pinned_letter, pinned_key = pinned
+        pos[pinned_letter] = pinned_key
+        letter_order = [letter for letter in letter_order if letter != pinned_letter]
+        key_order = [key for key in key_order if key != pinned_key]
+    for letter, key in zip(letter_order, key_order):
+        pos[letter] = key
+
+    freq_list = freq.tolist()
+    penalty_list = penalty.tolist()
+    # 固定した文字はletter_orderから除いてあるので入れ替えの対象にならない
+    swappable = sorted(letter_order)
+    for _ in range(max_passes):
+        improved = False
+        for a, b in combinations(swappable, 2):
+            if swap_delta(freq_list, penalty_list, pos, a, b) < 0:
+                pos[a], pos[b] = pos[b], pos[a]
+                improved = True
+        if not improved:
+            break
+    return pos
+
+
+def anneal_keymap(penalty2, letters, input_bytes, iterations=100000, restarts=4, seed=None):
+    """
+    焼きなまし法でキーマップを最適化する関数。
+    CP-SATと同じ目的関数を、2文字のキーを入れ替える近傍で探索します。
+    最適性の保証はありませんが、30文字なら入れ替え1回あたり約9マイクロ秒なので、
+    既定の設定 (100000回 x 4回) で3〜4秒ほどで良い配置が得られます。
+    Args:
+        penalty2 (list of list of int): キー間のペナルティを表す行列。整数に変換したもの。
+        letters (list of str): 割り当てる文字のリスト。
+        input_bytes (bytes or mmap.mmap): 連接頻度を計算するための入力テキストのバイト列。
+        iterations (int): 1回の焼きなましで試す入れ替えの回数。
+        restarts (int): ランダムな初期配置からやり直す回数。
+        seed (int): 乱数のシード。
+    Returns:
+        list of str: 最適化されたキー割り当てを表すリスト。キーの位置に対応する文字が格納されます。
+    """
+    L = len(letters)
+    rng = np.random.default_rng(seed)
+
+    # CP-SATのモデルと同じく、同じ文字の連続とk1 >= k2の組は数えない
+    freq = count_bigrams(letters, input_bytes).astype(np.int64)
+    np.fill_diagonal(freq, 0)
+    penalty = np.triu(np.array(penalty2, dtype=np.int64), k=1)
+
+    freq_list = freq.tolist()
+    penalty_list = penalty.tolist()
+
+    best_pos = None
+    best_cost = None
+    for _ in range(restarts):
+        pos = rng.permutation(L).tolist()
+        cost = layout_cost(freq, penalty, pos)
+        if best_cost is None or cost < best_cost:
+            best_cost = cost
+            best_pos = pos.copy()
+
+        # 入れ替える文字の組 b != aになるようにずらす
+        a_list = rng.integers(L, size=iterations)
+        b_list = (a_list + 1 + rng.integers(L - 1, size=iterations)) % L
+        a_list = a_list.tolist()
+        b_list = b_list.tolist()
+        u_list = rng.random(iterations).tolist()
+
+        # 初期温度はランダムな入れ替えによる変化量の平均から決め、0.1%まで指数的に下げる
+        sample = [abs(swap_delta(freq_list, penalty_list, pos, a, b))
+                  for a, b in zip(a_list[:100], b_list[:100])]
+        t_start = max(sum(sample) / len(sample), 1.0) if sample else 1.0
+        t_end = t_start * 1e-3
+
+        for it, (a, b, u) in enumerate(zip(a_list, b_list, u_list)):
+            t = t_start * (t_end / t_start) ** (it / iterations)
+            delta = swap_delta(freq_list, penalty_list, pos, a, b)
+            if delta <= 0 or u < math.exp(-delta / t):
+                pos[a], pos[b] = pos[b], pos[a]
+                cost += delta
+                if cost < best_cost:
+                    best_cost = cost
+                    best_pos = pos.copy()
+
+        print(f"Restart objective = {cost}")
+
+    print(f"Objective = {best_cost}")
+
+    # result[key] = letterを作る
+    result = [None] * L
+    for i, key in enumerate(best_pos):
+        result[key] = letters[i]
+    return result
+
+
 # 最適化したい文字
 letters_ = ['Q', 'W', 'E', 'R', 'T', 'Y', 'U', 'I', 'O', 'P',
             'A', 'S', 'D', 'F', 'G', 'H', 'J', 'K', 'L', ';',
@@ -125,19 +509,39 @@ penalty_2gram = [
     [0.288, 0.339, 0.357, 0.343, 0.310, 0.329, 0.329, 0.386, 0.465, 0.562, 0.267, 0.267, 0.288, 0.299, 0.375, 0.264, 0.183, 0.375, 0.329, 0.437, 0.296, 0.238, 0.245, 0.270, 0.264, 0.202, 0.234, 0.346, 0.361, 0.307],  # /
 ]
 
-if len(sys.argv) < 2:
-    print("Usage: python keymap_optimizer.py <input_file>")
-    sys.exit(1)
+# CP-SATは整数しか扱えないので、ペナルティを1000倍して整数にしておく
+penalty_2gram_int = tuple(tuple(round(p * 1000) for p in row) for row in penalty_2gram)
 
-input_file = sys.argv[1]
+parser = argparse.ArgumentParser(description='数理最適化でキーマップを作る')
+parser.add_argument('input_file', help='連接頻度を計算するための入力テキスト')
+parser.add_argument('--solver', choices=['cpsat', 'anneal'], default='cpsat',
+                    help='cpsat: CP-SATで厳密に解く, anneal: 焼きなまし法で近似的に解く')
+parser.add_argument('--formulation', choices=['linear', 'element'], default='linear',
+                    help='CP-SATの定式化 linear: 割り当て変数の積を線形化 (推奨), '
+                         'element: 文字の位置とAddElement (実験的、通常はlinearより遅い)')
+parser.add_argument('--pin', action='store_true',
+                    help='最も頻度の高い文字を最もペナルティの小さいキーに固定して探索を速める')
+parser.add_argument('--target', type=float, default=None,
+                    help='CP-SATでこの目的関数の値以下の解が見つかったら探索を打ち切る')
+parser.add_argument('--first-solution', action='store_true',
+                    help='CP-SATで最初の実行可能解が見つかったら探索を打ち切る')
+parser.add_argument('--workers', type=int, default=None,
+                    help='CP-SATの並列探索に使うワーカー数 (省略時はCPUのコア数)')
+args = parser.parse_args()
 
-with open(input_file, 'r', encoding='utf-8') as file:
-    input_text_ = file.read()
+# 大きなファイルでもメモリに読み込まないようにmmapする 空のファイルはmmapできない
+with open(args.input_file, 'rb') as file:
+    if os.fstat(file.fileno()).st_size > 0:
+        input_bytes_ = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        input_bytes_ = b''
 
-result = optimize_keymap(penalty_2gram, letters_, input_text_.upper())
+if args.solver == 'anneal':
+    result = anneal_keymap(penalty_2gram_int, letters_, input_bytes_)
+else:
+    result = optimize_keymap(penalty_2gram_int, letters_, input_bytes_, num_workers=args.workers,
+                             pin_top_letter=args.pin, formulation=args.formulation,
+                             target_objective=args.target, stop_after_first_solution=args.first_solution)
 
 # 10列3行で表示
-for i, l in enumerate(result):
-    print(l, end=' ')
-    if i % 10 == 9:
-        print("")
+print_keymap(result)